@@ -0,0 +1,53 @@
+#!/usr/bin/python
+"""
+Benchmark for matchers of ReplaceByDict.
+Time to replace urls in the same text must not depend on size of dictionary.
+
+Usage: python benchmark.py [size size ...]
+"""
+import os, sys, tempfile, time
+
+example_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path[0:0] = [os.path.join(os.path.dirname(example_dir), 'modelurl')]
+
+from diskindex import MmapDict, write
+from matchers import MmapMatcher, RegexMatcher, TrieMatcher
+
+LINKS = 500
+
+def dictionary(size):
+    result = {}
+    for index in xrange(size):
+        result['/page_by_id/%s' % index] = '{@ example.models.Page %s @}' % index
+    return result
+
+def text(size):
+    return ''.join(['<p>Link to <a href="/page_by_id/%s">page</a>.</p>\n' % (index * size // LINKS)
+        for index in xrange(LINKS)])
+
+def measure(function, *args):
+    start = time.time()
+    result = function(*args)
+    return time.time() - start, result
+
+def mmap_matcher(dct):
+    path = os.path.join(tempfile.mkdtemp(), 'index')
+    write(dct, path)
+    matcher = MmapMatcher(MmapDict(path))
+    os.remove(path)
+    return matcher
+
+def main(sizes):
+    print '%10s %12s %10s %10s %13s' % ('size', 'matcher', 'build, s', 'text, s', 'per link, us')
+    for size in sizes:
+        dct = dictionary(size)
+        value = text(size)
+        for matcher_class in [RegexMatcher, TrieMatcher, mmap_matcher]:
+            build, matcher = measure(matcher_class, dct)
+            sub, result = measure(matcher.sub, value)
+            assert result.count('{@') == LINKS
+            print '%10s %12s %10.3f %10.4f %13.1f' % (size, matcher.__class__.__name__,
+                build, sub, sub / LINKS * 1000000)
+
+if __name__ == '__main__':
+    main([int(size) for size in sys.argv[1:]] or [1000, 10000, 50000])
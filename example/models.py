@@ -1,14 +1,32 @@
 from django.db import models
 from django.core.urlresolvers import reverse
+from modelurl.fields import MacroTextField
+from modelurl.managers import ModelUrlManager
+from modelurl.mixins import ExpandedMixin
 
 class Page(models.Model):
-    content = models.TextField()
+    content = MacroTextField()
     
     def get_absolute_url(self):
         return reverse('page_by_id', args=[self.id])
 
 class Item(models.Model):
     barcode = models.CharField(max_length=100, unique=True)
+
+    objects = ModelUrlManager()
     
     def my_url(self):
         return reverse('item_by_barcode', kwargs={'barcode': self.barcode})
+
+    @classmethod
+    def my_urls(cls, pks):
+        result = {}
+        for pk, barcode in cls.objects.filter(pk__in=pks).values_list('pk', 'barcode'):
+            result[pk] = reverse('item_by_barcode', kwargs={'barcode': barcode})
+        return result
+
+class Article(ExpandedMixin, models.Model):
+    content = models.TextField()
+    content_expanded = models.TextField(editable=False)
+
+    expanded_fields = {'content': 'content_expanded'}
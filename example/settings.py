@@ -6,6 +6,12 @@ DATABASE_ENGINE = 'sqlite3'
 DATABASE_NAME = 'modelurl.sqlite'
 SITE_ID = 1
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
 SECRET_KEY = 'woh(%=g%iu2sieo1!ztovprqr#8(s^(87tbjw61%45x)oi2n33'
 
 ROOT_URLCONF = 'example.urls'
@@ -35,13 +41,22 @@ MIDDLEWARE_CLASSES = [
 MODELURL_MODELS = [
     {
         'model': 'example.models.Page',
+        'only': ['id'],
+        'reverse': {'name': 'page_by_id', 'args': ['id']},
     },
     {
         'model': 'example.models.Item',
         'function': 'my_url',
+        'bulk_function': 'my_urls',
     },
 ]
 
+MODELURL_CACHE_SIZE = 100
+
+MODELURL_CACHE = 'default'
+
+MODELURL_INDEX = True
+
 MODELURL_VIEWS = [
     {
         'view': 'example.views.page_by_id',
@@ -0,0 +1,283 @@
+"""
+Index with urls and macros stored in file.
+File is opened with ``mmap``, so processes share one copy of it
+in memory and nothing must be loaded on start.
+
+Format of the file (all numbers are unsigned 32-bit little-endian):
+
+* header: magic ``MURLIDX2``, number of urls, length of the longest url;
+* offsets of urls, one more than number of urls;
+* offsets of macros, one more than number of urls;
+* indexes of urls sorted by their macros;
+* sorted lower-cased utf-8 encoded urls;
+* macros in the same order.
+"""
+
+import os
+import mmap
+import struct
+import tempfile
+
+MAGIC = 'MURLIDX2'
+HEADER = struct.Struct('<8sII')
+OFFSET = struct.Struct('<I')
+
+class BadIndex(ValueError):
+    """
+    File is not an url index.
+    """
+
+def encode(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+def write(dct, path):
+    """
+    Write ``dct`` with lower-cased urls and macros to the file.
+    File will be replaced atomically, so processes that
+    opened old file will continue to use it.
+    """
+    items = [(encode(key), encode(value)) for key, value in dct.iteritems()]
+    items.sort()
+    count = len(items)
+    maxlen = max([len(key) for key, value in items] or [0])
+    start = HEADER.size + OFFSET.size * ((count + 1) * 2 + count)
+    key_offsets = [start]
+    for key, value in items:
+        key_offsets.append(key_offsets[-1] + len(key))
+    value_offsets = [key_offsets[-1]]
+    for key, value in items:
+        value_offsets.append(value_offsets[-1] + len(value))
+    order = range(count)
+    order.sort(key=lambda index: items[index][1])
+    directory = os.path.dirname(os.path.abspath(path))
+    descriptor, temp = tempfile.mkstemp(dir=directory)
+    try:
+        output = os.fdopen(descriptor, 'wb')
+        try:
+            output.write(HEADER.pack(MAGIC, count, maxlen))
+            output.write(struct.pack('<%dI' % (count + 1), *key_offsets))
+            output.write(struct.pack('<%dI' % (count + 1), *value_offsets))
+            output.write(struct.pack('<%dI' % count, *order))
+            output.write(''.join([key for key, value in items]))
+            output.write(''.join([value for key, value in items]))
+        finally:
+            output.close()
+        os.chmod(temp, 0644)
+        os.rename(temp, path)
+    except:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+
+class MmapDict(object):
+    """
+    Read-only dictionary with lower-cased urls and macros opened from file.
+    Urls will be found by binary search over sorted urls.
+    Changes are kept in memory of the process and are not written to the file.
+
+    >>> import os, tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), 'index')
+    >>> write({'/a': 'A', '/a/b': 'B', '/c': 'C'}, path)
+    >>> dct = MmapDict(path)
+    >>> len(dct), dct.maxlen
+    (3, 4)
+    >>> dct['/a/b'], dct.get(u'/c'), dct.get('/d')
+    ('B', 'C', None)
+    >>> dct.prefix_range('/a')
+    (0, 2)
+    >>> dct.prefix_range('/a/', 0, 2)
+    (1, 2)
+    >>> dct.prefix_range('/b')
+    (2, 2)
+    >>> dct.initials()
+    set(['/'])
+    >>> dct.find_key('B'), dct.find_key('D')
+    ('/a/b', None)
+    >>> list(dct.find_values('B')), list(dct.find_values('D'))
+    (['B'], [])
+
+    >>> dct['/d'] = 'D'
+    >>> dct.pop('/a')
+    'A'
+    >>> '/a' in dct
+    False
+    >>> sorted(dct.iteritems())
+    [('/a/b', 'B'), ('/c', 'C'), ('/d', 'D')]
+    >>> dct.close()
+    >>> os.remove(path)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        input = open(path, 'rb')
+        try:
+            self.mmap = mmap.mmap(input.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            input.close()
+        if len(self.mmap) < HEADER.size:
+            raise BadIndex('File "%s" is not an url index' % path)
+        magic, self.count, self.maxlen = HEADER.unpack_from(self.mmap, 0)
+        if magic != MAGIC:
+            raise BadIndex('File "%s" is not an url index' % path)
+        self.key_offsets = HEADER.size
+        self.value_offsets = HEADER.size + OFFSET.size * (self.count + 1)
+        self.order = self.value_offsets + OFFSET.size * (self.count + 1)
+        # Url to the changed macro or None for removed url.
+        self.changes = {}
+
+    def close(self):
+        self.mmap.close()
+
+    def offset(self, table, index):
+        return OFFSET.unpack_from(self.mmap, table + OFFSET.size * index)[0]
+
+    def key(self, index):
+        """
+        Return url with specified ``index`` in the file.
+        """
+        return self.mmap[self.offset(self.key_offsets, index):
+            self.offset(self.key_offsets, index + 1)]
+
+    def value(self, index):
+        """
+        Return macro with specified ``index`` in the file.
+        """
+        return self.mmap[self.offset(self.value_offsets, index):
+            self.offset(self.value_offsets, index + 1)]
+
+    def bisect(self, key, low, high):
+        while low < high:
+            middle = (low + high) // 2
+            if self.key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def find(self, key, low=0, high=None):
+        """
+        Return index of url in the file or None.
+        Search will be made between ``low`` and ``high``.
+        """
+        if high is None:
+            high = self.count
+        index = self.bisect(key, low, high)
+        if index < high and self.key(index) == key:
+            return index
+        return None
+
+    def prefix_range(self, prefix, low=0, high=None):
+        """
+        Return range of indexes of urls that starts with ``prefix``.
+        Search will be made between ``low`` and ``high``.
+        """
+        if high is None:
+            high = self.count
+        low = self.bisect(prefix, low, high)
+        # 0xFF byte can not be found in utf-8.
+        return low, self.bisect(prefix + '\xff', low, high)
+
+    def find_key(self, value):
+        """
+        Return url for macro ``value`` in the file or None.
+        Search will be made over indexes of urls sorted by macros.
+        """
+        value = encode(value)
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.value(self.offset(self.order, middle)) < value:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count:
+            index = self.offset(self.order, low)
+            if self.value(index) == value:
+                return self.key(index)
+        return None
+
+    def find_values(self, prefix):
+        """
+        Yield macros in the file that starts with ``prefix``.
+        """
+        prefix = encode(prefix)
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.value(self.offset(self.order, middle)) < prefix:
+                low = middle + 1
+            else:
+                high = middle
+        while low < self.count:
+            value = self.value(self.offset(self.order, low))
+            if not value.startswith(prefix):
+                break
+            yield value
+            low += 1
+
+    def initials(self):
+        """
+        Return set with first bytes of urls in the file.
+        """
+        result = set()
+        low = 0
+        while low < self.count:
+            initial = self.key(low)[:1]
+            result.add(initial)
+            low = self.bisect(initial + '\xff', low, self.count)
+        return result
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __getitem__(self, key):
+        key = encode(key)
+        if key in self.changes:
+            value = self.changes[key]
+        else:
+            index = self.find(key)
+            if index is None:
+                raise KeyError(key)
+            value = self.value(index)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __setitem__(self, key, value):
+        self.changes[encode(key)] = value
+
+    def pop(self, key, *args):
+        try:
+            value = self[key]
+        except KeyError:
+            if args:
+                return args[0]
+            raise
+        self.changes[encode(key)] = None
+        return value
+
+    def iteritems(self):
+        for index in xrange(self.count):
+            key = self.key(index)
+            if key not in self.changes:
+                yield key, self.value(index)
+        for key, value in self.changes.iteritems():
+            if value is not None:
+                yield key, value
+
+    def __iter__(self):
+        for key, value in self.iteritems():
+            yield key
+
+    def __len__(self):
+        if not self.changes:
+            return self.count
+        return len(list(self))
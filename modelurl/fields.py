@@ -0,0 +1,57 @@
+"""
+Model fields to store content with macros.
+"""
+
+from django.db import models
+from django.utils.functional import curry
+
+from modelurl.utils import tokenize, expand_tokens
+
+def get_expanded(instance, field):
+    value = getattr(instance, field.attname)
+    if value is None:
+        return None
+    return expand_tokens(value, getattr(instance, field.tokens_name))
+
+class MacroTextField(models.TextField):
+    """
+    Text field with macros.
+    Positions of macros will be stored in additional ``<name>_macros`` field
+    on save, so ``get_<name>_expanded`` method of instance
+    will replace macros with urls without regular expressions.
+
+    >>> from example.models import Page, Item
+    >>> page = Page.objects.get(pk=1)
+    >>> page.content = '<a href="{@ example.models.Page 11 @}">Page</a><a href="{@ example.models.Item 1 @}">Item</a>'
+    >>> page.save()
+    >>> page = Page.objects.get(pk=1)
+    >>> page.content_macros
+    u'93\\n9 37 example.models.Page 11\\n56 83 example.models.Item 1'
+    >>> page.get_content_expanded()
+    u'<a href="/page_by_id/11">Page</a><a href="/item_by_barcode/first">Item</a>'
+
+    # Changed content will be processed by regular expression
+    >>> page.content = '<a href="{@ example.models.Item 2 @}">Item</a>'
+    >>> page.get_content_expanded()
+    '<a href="/item_by_barcode/second">Item</a>'
+
+    # Empty value of nullable field has no macros
+    >>> from modelurl.models import update_links
+    >>> page.content = None
+    >>> page.get_content_expanded() is None
+    True
+    >>> update_links(Page, page)
+    """
+
+    def contribute_to_class(self, cls, name):
+        super(MacroTextField, self).contribute_to_class(cls, name)
+        self.tokens_name = '%s_macros' % name
+        if not cls._meta.abstract:
+            cls.add_to_class(self.tokens_name,
+                models.TextField(editable=False, blank=True, default=''))
+        setattr(cls, 'get_%s_expanded' % name, curry(get_expanded, field=self))
+
+    def pre_save(self, model_instance, add):
+        value = super(MacroTextField, self).pre_save(model_instance, add)
+        setattr(model_instance, self.tokens_name, tokenize(value))
+        return value
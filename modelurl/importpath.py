@@ -1,11 +1,16 @@
+import threading
+
 from django.core.exceptions import ImproperlyConfigured
 
-def importpath(path, error_text=None):
-    """                                                                                               
+# Path to the pair of imported value and raised exception.
+cache = {}
+counters = {'hits': 0, 'misses': 0}
+lock = threading.Lock()
+
+def load(path):
+    """
     Import value by specified ``path``.
-    Value can represent module, class, object, attribute or method.
-    If ``error_text`` is not None and import will
-    raise ImproperlyConfigured with user friendly text.
+    Return pair of value and exception that must be raised.
     """
     result = None
     attrs = []
@@ -25,8 +30,74 @@ def importpath(path, error_text=None):
         try:
             result = getattr(result, attr)
         except (AttributeError, ValueError), error:
-            if error_text is not None:
-                raise ImproperlyConfigured('Error: %s can import "%s"' % (error_text, path))
-            else:
-                raise exception
+            return None, exception
+    return result, None
+
+def importpath(path, error_text=None):
+    """
+    Import value by specified ``path``.
+    Value can represent module, class, object, attribute or method.
+    If ``error_text`` is not None and import will
+    raise ImproperlyConfigured with user friendly text.
+    Results of both successful and failed imports are cached.
+    """
+    try:
+        result, exception = cache[path]
+    except KeyError:
+        result, exception = load(path)
+        lock.acquire()
+        try:
+            cache[path] = (result, exception)
+            counters['misses'] += 1
+        finally:
+            lock.release()
+    else:
+        lock.acquire()
+        try:
+            counters['hits'] += 1
+        finally:
+            lock.release()
+    if exception is not None:
+        if error_text is not None:
+            raise ImproperlyConfigured('Error: %s can import "%s"' % (error_text, path))
+        else:
+            raise exception
     return result
+
+def stats():
+    """
+    Return number of cache hits and misses.
+
+    >>> clear()
+    >>> importpath('example.models.Page').__name__
+    'Page'
+    >>> importpath('example.models.Page').__name__
+    'Page'
+    >>> importpath('example.models.DoesNotExists')
+    Traceback (most recent call last):
+        ...
+    ImportError: No module named DoesNotExists
+    >>> importpath('example.models.DoesNotExists', 'test')
+    Traceback (most recent call last):
+        ...
+    ImproperlyConfigured: Error: test can import "example.models.DoesNotExists"
+    >>> stats()
+    {'hits': 2, 'misses': 2}
+    """
+    lock.acquire()
+    try:
+        return dict(counters)
+    finally:
+        lock.release()
+
+def clear():
+    """
+    Clear cache and counters.
+    """
+    lock.acquire()
+    try:
+        cache.clear()
+        counters['hits'] = 0
+        counters['misses'] = 0
+    finally:
+        lock.release()
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from modelurl import utils
+from modelurl.registry import get_registry
+
+class Command(BaseCommand):
+    args = '[model model ...]'
+    help = 'Invalidate cached urls of registered models after bulk changes.'
+
+    def handle(self, *args, **options):
+        if utils.shared is None:
+            raise CommandError('MODELURL_CACHE setting is required to invalidate '
+                'urls in running processes.')
+        for path in args or get_registry().models.keys():
+            utils.bump(path)
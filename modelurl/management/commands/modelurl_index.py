@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from modelurl.models import ModelUrlIndex
+
+class Command(BaseCommand):
+    args = '[model model ...]'
+    help = 'Store urls of objects of registered models in ModelUrlIndex.'
+
+    def handle(self, *args, **options):
+        ModelUrlIndex.objects.rebuild(args or None)
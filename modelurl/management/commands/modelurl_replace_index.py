@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from modelurl.utils import ReplaceByDict
+
+class Command(BaseCommand):
+    args = '[path]'
+    help = 'Save urls of objects of registered models to the file for ReplaceByDict.open.'
+
+    def handle(self, *args, **options):
+        path = args and args[0] or getattr(settings, 'MODELURL_REPLACE_INDEX', None)
+        if not path:
+            raise CommandError('Specify path or MODELURL_REPLACE_INDEX setting.')
+        replace = ReplaceByDict.from_models(build_matcher=False)
+        replace.save(path)
+        self.stdout.write('%(urls)s urls saved in %(time).1f s\n' % replace.stats)
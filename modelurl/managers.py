@@ -0,0 +1,47 @@
+"""
+Managers that invalidate cached urls after bulk operations.
+"""
+
+from django.conf import settings
+from django.db import models
+from django.db.models.query import QuerySet
+
+from modelurl.utils import bump
+
+class ModelUrlQuerySet(QuerySet):
+    """
+    QuerySet that invalidates cached urls for its model after bulk operations.
+    """
+
+    def indexed_pks(self):
+        """
+        Return pks of objects if ``MODELURL_INDEX`` is enabled.
+        """
+        if getattr(settings, 'MODELURL_INDEX', False):
+            return list(self.values_list('pk', flat=True))
+        return None
+
+    def update(self, **kwargs):
+        pks = self.indexed_pks()
+        rows = super(ModelUrlQuerySet, self).update(**kwargs)
+        bump(self.model, pks)
+        return rows
+    update.alters_data = True
+
+    if hasattr(QuerySet, 'bulk_create'):
+        def bulk_create(self, objs, *args, **kwargs):
+            result = super(ModelUrlQuerySet, self).bulk_create(objs, *args, **kwargs)
+            pks = [obj.pk for obj in result]
+            if None in pks:
+                # Backend does not return pks, all urls will be stored again.
+                pks = None
+            bump(self.model, pks)
+            return result
+
+class ModelUrlManager(models.Manager):
+    """
+    Manager that returns ModelUrlQuerySet.
+    """
+
+    def get_query_set(self):
+        return ModelUrlQuerySet(self.model, using=self._db)
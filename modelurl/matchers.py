@@ -0,0 +1,353 @@
+"""
+Matchers to find urls in text and replace them with macros.
+Matcher receives dictionary with lower-cased urls and macros.
+Url will be replaced if it is followed by space, one of ``#?"'>``
+or end of the text. Longest url will be used.
+"""
+
+import re
+import sys
+
+from diskindex import encode
+
+# Characters that can follow url.
+BOUNDARY = frozenset(' \t\n\r\f\v#?"\'>')
+
+class RegexMatcher(object):
+    """
+    Matcher that uses regular expression with alternation of all urls.
+
+    >>> matcher = RegexMatcher({'/a': 'A', '/a/b': 'B'})
+    >>> matcher.sub('/a/b /a /a/c "/A/B"')
+    'B A /a/c "B"'
+    """
+
+    def __init__(self, dct):
+        self.dct = dict(dct)
+        self._regexp = None
+
+    @property
+    def regexp(self):
+        if self._regexp is None:
+            keys = self.dct.keys()
+            keys.sort(reverse=True)
+            self._regexp = re.compile(r'''(%s)(?=\s|[#?"'>]|$)''' %
+                '|'.join([re.escape(key) for key in keys]),
+                re.IGNORECASE)
+        return self._regexp
+
+    def add(self, key, value):
+        """
+        Add url. Regular expression will be compiled again on next use.
+        """
+        self.dct[key] = value
+        self._regexp = None
+
+    def remove(self, key):
+        """
+        Remove url. Regular expression will be compiled again on next use.
+        """
+        self.dct.pop(key, None)
+        self._regexp = None
+
+    def size(self):
+        """
+        Return approximate number of bytes used by matcher without macros.
+        Compiled code of regular expression is not counted.
+        """
+        result = sys.getsizeof(self.dct) + sum([sys.getsizeof(key) for key in self.dct])
+        if self._regexp is not None:
+            result += sys.getsizeof(self._regexp.pattern)
+        return result
+
+    def sub(self, value):
+        def replace(match):
+            return self.dct.get(match.group(1).lower(), match.group(1))
+        return self.regexp.sub(replace, value)
+
+class TrieMatcher(object):
+    """
+    Matcher that uses compressed prefix tree of urls.
+    Time of search depends on length of the text and length of urls,
+    but not on the number of urls.
+
+    >>> matcher = TrieMatcher({'/a': 'A', '/a/b': 'B'})
+    >>> matcher.sub('/a/b /a /a/c "/A/B"')
+    'B A /a/c "B"'
+    >>> matcher.sub('/a/b/a/c')
+    '/a/b/a/c'
+    >>> matcher.sub('/a/b/a')
+    '/a/bA'
+
+    >>> matcher.remove('/a/b')
+    >>> matcher.root
+    {'/': ('/a', {None: 'A'})}
+    >>> matcher.sub('/a/b /a')
+    '/a/b A'
+    >>> matcher.add('/a/b/c', 'C')
+    >>> matcher.add('/a/d', 'D')
+    >>> matcher.sub('/a/b/c /a /a/d /a/b')
+    'C A D /a/b'
+    >>> matcher.remove('/a')
+    >>> matcher.remove('/a/d')
+    >>> matcher.root
+    {'/': ('/a/b/c', {None: 'C'})}
+    """
+
+    def __init__(self, dct):
+        # Each node is dictionary with edge for first character of each label.
+        # Edge is pair of label (part of url) and child node.
+        # Macro is stored in node with None key.
+        self.root = {}
+        for key, value in dct.iteritems():
+            if key:
+                self.add(key, value)
+
+    def add(self, key, value):
+        """
+        Add url.
+        """
+        node = self.root
+        position = 0
+        while position < len(key):
+            edge = node.get(key[position])
+            if edge is None:
+                node[key[position]] = (key[position:], {None: value})
+                return
+            label, child = edge
+            common = 1
+            while common < len(label) and position + common < len(key) and \
+                label[common] == key[position + common]:
+                common += 1
+            if common < len(label):
+                # Split edge at the end of common part.
+                middle = {label[common]: (label[common:], child)}
+                node[key[position]] = (label[:common], middle)
+                child = middle
+            node = child
+            position += common
+        node[None] = value
+
+    def join(self, node, char):
+        """
+        Join edge of ``node`` with the only edge of its child without macro.
+        """
+        label, child = node[char]
+        if None not in child and len(child) == 1:
+            tail, grandchild = child.values()[0]
+            node[char] = (label + tail, grandchild)
+
+    def remove(self, key):
+        """
+        Remove url and nodes that are not used anymore.
+        """
+        path = []
+        node = self.root
+        position = 0
+        while position < len(key):
+            edge = node.get(key[position])
+            if edge is None or not key.startswith(edge[0], position):
+                return
+            path.append((node, key[position]))
+            node = edge[1]
+            position += len(edge[0])
+        if None not in node or not path:
+            return
+        del node[None]
+        parent, char = path.pop()
+        if node:
+            self.join(parent, char)
+            return
+        del parent[char]
+        if path:
+            self.join(*path.pop())
+
+    def size(self):
+        """
+        Return approximate number of bytes used by tree without macros.
+        """
+        result = 0
+        nodes = [self.root]
+        while nodes:
+            node = nodes.pop()
+            result += sys.getsizeof(node)
+            for char, edge in node.iteritems():
+                if char is not None:
+                    result += sys.getsizeof(edge) + sys.getsizeof(edge[0])
+                    nodes.append(edge[1])
+        return result
+
+    def search(self, value, lower, start):
+        """
+        Return end and macro of the longest url
+        that starts at ``start`` position or None.
+        """
+        length = len(value)
+        found = None
+        end = start
+        edge = self.root.get(lower[start])
+        while edge is not None:
+            label, node = edge
+            if not lower.startswith(label, end):
+                break
+            end += len(label)
+            if None in node and (end == length or value[end] in BOUNDARY):
+                found = end, node[None]
+            if end == length:
+                break
+            edge = node.get(lower[end])
+        return found
+
+    def sub(self, value):
+        lower = value.lower()
+        root = self.root
+        length = len(value)
+        result = []
+        position = 0
+        start = 0
+        while start < length:
+            found = None
+            if lower[start] in root:
+                found = self.search(value, lower, start)
+            if found is None:
+                start += 1
+                continue
+            result.append(value[position:start])
+            result.append(found[1])
+            position = start = found[0]
+        if not position:
+            return value
+        result.append(value[position:])
+        return ''.join(result)
+
+class MmapMatcher(object):
+    """
+    Matcher that uses ``modelurl.diskindex.MmapDict`` opened from file.
+    Urls that starts in each position of the text are found by binary search
+    over sorted urls in the file, so nothing is loaded to memory.
+    Urls added after file was opened are kept in prefix tree.
+
+    >>> import os, tempfile
+    >>> from diskindex import write, MmapDict
+    >>> path = os.path.join(tempfile.mkdtemp(), 'index')
+    >>> write({'/a': 'A', '/a/b': 'B'}, path)
+    >>> dct = MmapDict(path)
+    >>> matcher = MmapMatcher(dct)
+    >>> matcher.sub('/a/b /a /a/c "/A/B"')
+    'B A /a/c "B"'
+    >>> matcher.sub(u'/a/b/a/c /\u0444 /a')
+    u'/a/b/a/c /\u0444 A'
+
+    >>> dct.pop('/a/b')
+    'B'
+    >>> matcher.remove('/a/b')
+    >>> matcher.sub('/a/b /a')
+    '/a/b A'
+    >>> dct['/a/b/c'] = 'C'
+    >>> matcher.add('/a/b/c', 'C')
+    >>> matcher.sub('/a/b/c /a')
+    'C A'
+    >>> dct.close()
+    >>> os.remove(path)
+    """
+
+    # Ranges of urls for short prefixes are cached.
+    PREFIX_LENGTH = 8
+    RANGES_LIMIT = 10000
+
+    def __init__(self, dct):
+        self.dct = dct
+        self.initials = dct.initials()
+        self.ranges = {}
+        self.tree = TrieMatcher({})
+        for key, value in dct.changes.iteritems():
+            if value is not None:
+                self.tree.add(key, value)
+
+    def add(self, key, value):
+        """
+        Add url to the prefix tree.
+        """
+        self.tree.add(key, value)
+
+    def remove(self, key):
+        """
+        Remove url from the prefix tree.
+        Urls from the file must be removed from dictionary.
+        """
+        self.tree.remove(key)
+
+    def prefix_range(self, prefix, low, high):
+        if len(prefix) > self.PREFIX_LENGTH:
+            return self.dct.prefix_range(prefix, low, high)
+        try:
+            return self.ranges[prefix]
+        except KeyError:
+            pass
+        result = self.dct.prefix_range(prefix, low, high)
+        if len(self.ranges) >= self.RANGES_LIMIT:
+            self.ranges.clear()
+        self.ranges[prefix] = result
+        return result
+
+    def search(self, value, lower, start):
+        """
+        Return end and macro of the longest url from the file
+        that starts at ``start`` position or None.
+        """
+        dct = self.dct
+        length = len(value)
+        # Check that some urls starts with beginning of the text.
+        low, high = 0, dct.count
+        prefix = ''
+        limit = min(length, start + dct.maxlen)
+        end = start
+        while end < length and len(prefix) < self.PREFIX_LENGTH:
+            candidate = prefix + encode(lower[end])
+            candidate_low, candidate_high = self.prefix_range(candidate, low, high)
+            if candidate_low == candidate_high:
+                # Urls can not be longer than prefix.
+                limit = end
+                break
+            prefix = candidate
+            low, high = candidate_low, candidate_high
+            end += 1
+        # Look for urls that ends before boundaries, the longest first.
+        for end in xrange(limit, start, -1):
+            if end != length and value[end] not in BOUNDARY:
+                continue
+            key = encode(lower[start:end])
+            if key in dct.changes or not key.startswith(prefix):
+                macro = dct.get(key)
+            else:
+                index = dct.find(key, low, high)
+                macro = index is not None and dct.value(index) or None
+            if macro is not None:
+                return end, macro
+        return None
+
+    def sub(self, value):
+        lower = value.lower()
+        root = self.tree.root
+        length = len(value)
+        result = []
+        position = 0
+        start = 0
+        while start < length:
+            found = None
+            if encode(lower[start])[:1] in self.initials:
+                found = self.search(value, lower, start)
+            if lower[start] in root:
+                added = self.tree.search(value, lower, start)
+                if added is not None and (found is None or added[0] > found[0]):
+                    found = added
+            if found is None:
+                start += 1
+                continue
+            result.append(value[position:start])
+            result.append(found[1])
+            position = start = found[0]
+        if not position:
+            return value
+        result.append(value[position:])
+        return ''.join(result)
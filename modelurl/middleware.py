@@ -43,16 +43,79 @@ Replace macro in response with absolute urls.
 >>> page.save()
 >>> client.get('/page_by_id/1').content
 '<a href="{@ link @}">link</a>'
+
+# Iterator will be processed chunk by chunk
+>>> from django.http import HttpRequest, HttpResponse
+>>> response = HttpResponse(iter(['<a href="{@ example.models.Page', ' 1 @}">link</a>']))
+>>> response = ModelUrlMiddleware().process_response(HttpRequest(), response)
+>>> ''.join(response)
+'<a href="/page_by_id/1">link</a>'
+
+# Only marked responses are processed in strict mode
+>>> settings.MODELURL_STRICT = True
+>>> page.content = '<a href="%s">link</a>' % macro(item)
+>>> page.save()
+>>> client.get('/page_by_id/1').content
+'<a href="/item_by_barcode/changed">link</a>'
+>>> response = HttpResponse('<a href="%s">link</a>' % macro(item))
+>>> ModelUrlMiddleware().process_response(HttpRequest(), response).content
+'<a href="{@ example.models.Item 1 @}">link</a>'
+>>> from modelurl.utils import mark
+>>> response = mark(HttpResponse('<a href="%s">link</a>' % macro(item)))
+>>> ModelUrlMiddleware().process_response(HttpRequest(), response).content
+'<a href="/item_by_barcode/changed">link</a>'
+>>> del settings.MODELURL_STRICT
+
+# ETag will be calculated without fetching of objects
+>>> settings.MODELURL_ETAG = True
+>>> response = client.get('/page_by_id/1')
+>>> response.content
+'<a href="/item_by_barcode/changed">link</a>'
+>>> client.get('/page_by_id/1', HTTP_IF_NONE_MATCH=response['ETag']).status_code
+304
+>>> item.barcode = 'again'
+>>> item.save()
+>>> response = client.get('/page_by_id/1', HTTP_IF_NONE_MATCH=response['ETag'])
+>>> response.status_code
+200
+>>> response.content
+'<a href="/item_by_barcode/again">link</a>'
+>>> del settings.MODELURL_ETAG
 """
 
 from django.conf import settings
-from modelurl.utils import MACRO_RE, MACRO_REPL
+from django.http import HttpResponseNotModified
+from modelurl.utils import MACRO_RE, local, marked, expand, expand_chunks, get_etag
 
 class ModelUrlMiddleware(object):
+    def process_request(self, request):
+        local.modelurl_macros = False
+
     def process_response(self, request, response):
+        if getattr(settings, 'MODELURL_STRICT', False):
+            if not marked(response):
+                return response
+            local.modelurl_macros = False
         if 'content-type' in response._headers:
             if list(response._headers.get('content-type', [])[1:2]) != ["%s; charset=%s" % (
                 settings.DEFAULT_CONTENT_TYPE, settings.DEFAULT_CHARSET)]:
                 return response
-        response.content = MACRO_RE.sub(MACRO_REPL, response.content)
+        if getattr(response, '_is_string', True):
+            content = response.content
+            if getattr(settings, 'MODELURL_ETAG', False) and \
+                request.method in ('GET', 'HEAD') and \
+                response.status_code == 200 and not response.has_header('ETag'):
+                etag = get_etag(content)
+                if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+                    response = HttpResponseNotModified()
+                    response['ETag'] = etag
+                    return response
+                response['ETag'] = etag
+            if '{@' in content:
+                response.content = expand(content)
+        else:
+            # Don`t load all content to the memory.
+            response._container = expand_chunks(response._container)
+            if response.has_header('Content-Length'):
+                del response['Content-Length']
         return response
@@ -0,0 +1,40 @@
+"""
+Mixins for models with macros.
+"""
+
+from modelurl.utils import expand
+
+class ExpandedMixin(object):
+    """
+    Model mixin that stores content with expanded macros.
+    ``expanded_fields`` maps names of fields with macros
+    to names of fields for expanded content.
+    Links will be stored in ``modelurl.models.MacroLink``
+    and expanded content will be updated when linked object will be changed.
+
+    >>> from example.models import Article, Item
+    >>> article = Article(content='<a href="{@ example.models.Item 1 @}">Item</a>')
+    >>> article.save()
+    >>> article.content_expanded
+    '<a href="/item_by_barcode/first">Item</a>'
+
+    >>> item = Item.objects.get(pk=1)
+    >>> item.barcode = 'changed'
+    >>> item.save()
+    >>> Article.objects.get(pk=article.pk).content_expanded
+    u'<a href="/item_by_barcode/changed">Item</a>'
+
+    >>> item.delete()
+    >>> Article.objects.get(pk=article.pk).content_expanded
+    u'<a href="">Item</a>'
+    """
+
+    expanded_fields = {}
+
+    def save(self, *args, **kwargs):
+        for field, expanded in self.expanded_fields.iteritems():
+            value = getattr(self, field)
+            if value is not None:
+                value = expand(value)
+            setattr(self, expanded, value)
+        super(ExpandedMixin, self).save(*args, **kwargs)
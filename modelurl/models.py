@@ -0,0 +1,251 @@
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models.signals import post_save, post_delete
+from django.contrib.contenttypes.models import ContentType
+
+from modelurl.fields import MacroTextField
+from modelurl.registry import get_registry
+from modelurl.utils import MACRO_RE, invalidate, expand, index_key, \
+    sync_replace_by_dict
+
+class MacroLinkManager(models.Manager):
+    def update_links(self, obj, field, keys):
+        """
+        Set ``(model, pk)`` pairs in ``keys`` as targets for ``field`` of ``obj``.
+        Only added and removed links will be changed.
+        """
+        source_type = ContentType.objects.get_for_model(obj)
+        keys = set(keys)
+        removed = []
+        for link in self.filter(source_type=source_type, source_pk=obj.pk, field=field):
+            key = (link.target_model, link.target_pk)
+            if key in keys:
+                keys.remove(key)
+            else:
+                removed.append(link.pk)
+        if removed:
+            self.filter(pk__in=removed).delete()
+        for model, pk in keys:
+            self.create(source_type=source_type, source_pk=obj.pk, field=field,
+                target_model=model, target_pk=pk)
+
+    def incoming(self, obj):
+        """
+        Return links to ``obj``.
+        """
+        return self.filter(target_model='%s.%s' % (obj.__class__.__module__,
+            obj.__class__.__name__), target_pk=unicode(obj.pk))
+
+    def outgoing(self, obj):
+        """
+        Return links from ``obj``.
+        """
+        return self.filter(source_type=ContentType.objects.get_for_model(obj),
+            source_pk=unicode(obj.pk))
+
+    def in_degree(self, obj):
+        """
+        Return number of links to ``obj``.
+        """
+        return self.incoming(obj).count()
+
+    def out_degree(self, obj):
+        """
+        Return number of links from ``obj``.
+        """
+        return self.outgoing(obj).count()
+
+class MacroLink(models.Model):
+    """
+    Macro in ``field`` of source object that points to target object.
+    """
+    source_type = models.ForeignKey(ContentType)
+    source_pk = models.CharField(max_length=255)
+    field = models.CharField(max_length=100)
+    target_model = models.CharField(max_length=255, db_index=True)
+    target_pk = models.CharField(max_length=255, db_index=True)
+
+    objects = MacroLinkManager()
+
+class ModelUrlIndexManager(models.Manager):
+    def update_url(self, entry, obj):
+        """
+        Store current url for ``obj`` of registered model.
+        """
+        key = index_key(entry.path, obj.pk)
+        url = entry.url(obj)
+        if not self.filter(key=key).update(url=url):
+            self.create(key=key, model=entry.path, object_pk=obj.pk, url=url)
+
+    def store(self, entry, pks, urls):
+        """
+        Remove stored urls for objects with pk in ``pks``
+        and store ``urls`` dictionary with url for each pk.
+        Pks in ``urls`` that are not in ``pks`` will be ignored.
+        """
+        to_python = entry.model._meta.pk.to_python
+        self.filter(key__in=[index_key(entry.path, pk) for pk in pks]).delete()
+        rows = []
+        for pk, url in urls.iteritems():
+            try:
+                pk = to_python(pk)
+            except Exception:
+                continue
+            if pk in pks:
+                rows.append(ModelUrlIndex(key=index_key(entry.path, pk),
+                    model=entry.path, object_pk=pk, url=url))
+        if hasattr(self, 'bulk_create'):
+            self.bulk_create(rows)
+        else:
+            for row in rows:
+                row.save(force_insert=True)
+
+    def update_urls(self, entry, pks, chunk_size=1000):
+        """
+        Store current urls for objects of registered model with pk in ``pks``.
+        Urls of deleted objects will be removed.
+        """
+        to_python = entry.model._meta.pk.to_python
+        pks = list(pks)
+        for start in xrange(0, len(pks), chunk_size):
+            chunk = set([to_python(pk) for pk in pks[start:start + chunk_size]])
+            with transaction.commit_on_success():
+                self.store(entry, chunk, entry.urls(list(chunk)))
+
+    def rebuild(self, paths=None, chunk_size=1000):
+        """
+        Store urls for all objects of registered models.
+        ``paths`` is list of models to be processed, all models by default.
+        Urls are replaced by chunks of ``chunk_size`` objects in separate transactions,
+        so index is not empty while it is rebuilt.
+        """
+        models = get_registry().models
+        if paths is None:
+            paths = models.keys()
+        for path in paths:
+            entry = models[path]
+            to_python = entry.model._meta.pk.to_python
+            stored = set()
+            for urls in entry.iter_chunks(chunk_size):
+                pks = set()
+                for pk in urls:
+                    try:
+                        pks.add(to_python(pk))
+                    except Exception:
+                        continue
+                with transaction.commit_on_success():
+                    self.store(entry, pks, urls)
+                stored.update([index_key(path, pk) for pk in pks])
+            # Remove urls of objects that do not exist anymore.
+            removed = [key for key in self.filter(model=path).values_list('key', flat=True)
+                if key not in stored]
+            for start in xrange(0, len(removed), chunk_size):
+                self.filter(key__in=removed[start:start + chunk_size]).delete()
+
+class ModelUrlIndex(models.Model):
+    """
+    Current url of object of registered model.
+    Enabled by ``MODELURL_INDEX`` setting.
+    """
+    key = models.CharField(max_length=255, unique=True)
+    model = models.CharField(max_length=255, db_index=True)
+    object_pk = models.CharField(max_length=255)
+    url = models.TextField()
+
+    objects = ModelUrlIndexManager()
+
+def update_index(sender, instance, **kwargs):
+    """
+    Signal handler to store url for saved object.
+    """
+    if not getattr(settings, 'MODELURL_INDEX', False):
+        return
+    try:
+        entry = get_registry().senders[sender]
+    except KeyError:
+        return
+    ModelUrlIndex.objects.update_url(entry, instance)
+
+def remove_index(sender, instance, **kwargs):
+    """
+    Signal handler to remove url for deleted object.
+    """
+    if not getattr(settings, 'MODELURL_INDEX', False):
+        return
+    try:
+        entry = get_registry().senders[sender]
+    except KeyError:
+        return
+    ModelUrlIndex.objects.filter(key=index_key(entry.path, instance.pk)).delete()
+
+def update_dependents(sender, instance, **kwargs):
+    """
+    Signal handler to expand macros again in objects
+    that have links to changed or deleted object.
+    """
+    try:
+        entry = get_registry().senders[sender]
+    except KeyError:
+        return
+    sources = {}
+    for link in MacroLink.objects.incoming(instance):
+        sources.setdefault(link.source_type_id, {}).setdefault(
+            link.source_pk, set()).add(link.field)
+    for source_type, fields in sources.iteritems():
+        model = ContentType.objects.get_for_id(source_type).model_class()
+        expanded_fields = getattr(model, 'expanded_fields', {})
+        if not expanded_fields:
+            continue
+        # Base manager is used to process objects hidden by default manager.
+        manager = model._base_manager
+        for obj in manager.filter(pk__in=fields.keys()):
+            changes = {}
+            for field in fields[unicode(obj.pk)]:
+                try:
+                    expanded = expanded_fields[field]
+                except KeyError:
+                    continue
+                value = expand(getattr(obj, field))
+                if value != getattr(obj, expanded):
+                    changes[expanded] = value
+            if changes:
+                manager.filter(pk=obj.pk).update(**changes)
+
+def link_fields(model):
+    """
+    Return names of fields with macros that must be tracked in MacroLink.
+    """
+    names = set(getattr(model, 'expanded_fields', {}).keys())
+    for field in model._meta.fields:
+        if isinstance(field, MacroTextField):
+            names.add(field.name)
+    return names
+
+def update_links(sender, instance, **kwargs):
+    """
+    Signal handler to update links from saved object.
+    """
+    for field in link_fields(sender):
+        MacroLink.objects.update_links(instance, field,
+            MACRO_RE.findall(getattr(instance, field) or ''))
+
+def remove_links(sender, instance, **kwargs):
+    """
+    Signal handler to remove links from deleted object.
+    """
+    if not link_fields(sender):
+        return
+    MacroLink.objects.outgoing(instance).delete()
+
+# Index must be written before version is bumped, otherwise
+# concurrent resolve can cache old url with new version.
+post_save.connect(update_index)
+post_delete.connect(remove_index)
+post_save.connect(invalidate)
+post_delete.connect(invalidate)
+post_save.connect(update_dependents)
+post_save.connect(update_links)
+post_delete.connect(update_dependents)
+post_delete.connect(remove_links)
+post_save.connect(sync_replace_by_dict)
+post_delete.connect(sync_replace_by_dict)
@@ -0,0 +1,259 @@
+"""
+Registry of models and views specified in
+``MODELURL_MODELS`` and ``MODELURL_VIEWS`` settings.
+Settings will be imported only once.
+"""
+
+import re
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.urlresolvers import get_resolver, get_script_prefix, get_urlconf, reverse
+from django.utils.encoding import force_unicode, iri_to_uri
+
+from importpath import importpath
+
+class ReverseTemplate(object):
+    """
+    Build urls like ``reverse`` does, but with formatting of prepared strings.
+    ``args`` is list of fields for positional arguments,
+    ``kwargs`` is dictionary with fields for keyword arguments.
+
+    >>> template = ReverseTemplate('item_by_barcode', kwargs={'barcode': 'barcode'})
+    >>> template.fields
+    ['barcode']
+    >>> template.url(['first']) == reverse('item_by_barcode', kwargs={'barcode': 'first'})
+    True
+    >>> template.url(['first'])
+    '/item_by_barcode/first'
+
+    >>> template = ReverseTemplate('page_by_id', args=['id'])
+    >>> template.url([1]) == reverse('page_by_id', args=[1])
+    True
+    """
+
+    def __init__(self, name, args=None, kwargs=None):
+        self.name = name
+        self.args = list(args or [])
+        self.kwargs = dict(kwargs or {})
+        if self.args:
+            self.fields = self.args
+        else:
+            self.names = self.kwargs.keys()
+            self.fields = [self.kwargs[name] for name in self.names]
+        self.possibilities = None
+
+    def prepare(self):
+        """
+        Return list of format strings, names of parameters and compiled patterns.
+        """
+        possibilities = []
+        if ':' not in self.name:
+            resolver = get_resolver(None)
+            for possibility, pattern in resolver.reverse_dict.getlist(self.name):
+                compiled = re.compile(u'^%s' % pattern, re.UNICODE)
+                for result, params in possibility:
+                    if self.args:
+                        if len(self.args) != len(params):
+                            continue
+                    elif set(self.names) != set(params):
+                        continue
+                    possibilities.append((result, params, compiled))
+        return possibilities
+
+    def url(self, values):
+        """
+        Return url for ``values`` of fields.
+        """
+        if self.possibilities is None:
+            self.possibilities = self.prepare()
+        values = [force_unicode(value) for value in values]
+        if get_urlconf() is None:
+            if not self.args:
+                kwargs = dict(zip(self.names, values))
+            for result, params, pattern in self.possibilities:
+                if self.args:
+                    kwargs = dict(zip(params, values))
+                candidate = result % kwargs
+                if pattern.search(candidate):
+                    return iri_to_uri(u'%s%s' % (get_script_prefix(), candidate))
+        if self.args:
+            return reverse(self.name, args=values)
+        return reverse(self.name, kwargs=dict(zip(self.names, values)))
+
+class ModelEntry(object):
+    """
+    Registered model.
+
+    >>> from example.models import Item
+    >>> entry = get_registry().models['example.models.Item']
+    >>> entry.model is Item
+    True
+    >>> entry.url(Item.objects.get(pk=1))
+    '/item_by_barcode/first'
+
+    # prefetch_related is checked for old versions of Django
+    >>> def supported():
+    ...     try:
+    ...         ModelEntry({'model': 'example.models.Item', 'prefetch_related': ['barcode']})
+    ...     except ImproperlyConfigured:
+    ...         return False
+    ...     return True
+    >>> supported() == hasattr(Item.objects.all(), 'prefetch_related')
+    True
+    """
+
+    def __init__(self, setting):
+        self.setting = setting
+        self.path = setting['model']
+        self.model = importpath(self.path, 'MODELURL_MODELS')
+        self.manager = getattr(self.model, setting.get('manager', 'objects'))
+        if setting.get('prefetch_related', None) and \
+            not hasattr(self.manager.all(), 'prefetch_related'):
+            raise ImproperlyConfigured('Error: prefetch_related in MODELURL_MODELS '
+                'for "%s" requires Django 1.4 or later' % self.path)
+        self.function = setting.get('function', None) or 'get_absolute_url'
+        if setting.get('reverse', None):
+            self.template = ReverseTemplate(**setting['reverse'])
+        else:
+            self.template = None
+        if setting.get('bulk_function', None):
+            self.bulk_function = getattr(self.model, setting['bulk_function'])
+        else:
+            self.bulk_function = None
+
+    def url(self, obj):
+        """
+        Return url for specified ``obj``.
+        """
+        return getattr(obj, self.function)()
+
+    def queryset(self):
+        """
+        Return queryset to fetch objects with hints from setting.
+        """
+        queryset = self.manager.all()
+        if self.setting.get('only', None):
+            queryset = queryset.only(*self.setting['only'])
+        select_related = self.setting.get('select_related', None)
+        if select_related is True:
+            queryset = queryset.select_related()
+        elif select_related:
+            queryset = queryset.select_related(*select_related)
+        if self.setting.get('prefetch_related', None):
+            queryset = queryset.prefetch_related(*self.setting['prefetch_related'])
+        return queryset
+
+    def urls(self, values):
+        """
+        Return dictionary with url for each existing object with pk in ``values``.
+
+        >>> entry = get_registry().models['example.models.Item']
+        >>> entry.urls([1, 2, 3])
+        {1: '/item_by_barcode/first', 2: '/item_by_barcode/second'}
+
+        >>> entry = get_registry().models['example.models.Page']
+        >>> entry.urls([1, 11, 12])
+        {1: '/page_by_id/1', 11: '/page_by_id/11'}
+        """
+        if self.bulk_function is not None:
+            return self.bulk_function(values)
+        result = {}
+        if self.template is not None:
+            for row in self.queryset().filter(pk__in=values).values_list(
+                'pk', *self.template.fields):
+                result[row[0]] = self.template.url(row[1:])
+            return result
+        for value, obj in self.queryset().in_bulk(values).iteritems():
+            result[value] = self.url(obj)
+        return result
+
+    def iter_chunks(self, chunk_size=1000):
+        """
+        Yield dictionaries with url for each pk for all objects.
+        Objects will be fetched by chunks of ``chunk_size`` items.
+
+        >>> entry = get_registry().models['example.models.Page']
+        >>> list(entry.iter_chunks(chunk_size=1))
+        [{1: '/page_by_id/1'}, {11: '/page_by_id/11'}]
+        """
+        queryset = self.manager.all().order_by('pk')
+        last = None
+        while True:
+            chunk = queryset
+            if last is not None:
+                chunk = chunk.filter(pk__gt=last)
+            values = list(chunk.values_list('pk', flat=True)[:chunk_size])
+            if not values:
+                break
+            yield self.urls(values)
+            last = values[-1]
+
+    def iter_urls(self, chunk_size=1000):
+        """
+        Yield pk and url for all objects.
+        Objects will be fetched by chunks of ``chunk_size`` items.
+
+        >>> entry = get_registry().models['example.models.Page']
+        >>> sorted(entry.iter_urls(chunk_size=1))
+        [(1, '/page_by_id/1'), (11, '/page_by_id/11')]
+        """
+        for urls in self.iter_chunks(chunk_size):
+            for value, url in urls.iteritems():
+                yield value, url
+
+class Registry(object):
+    """
+    Registered models and views.
+    """
+
+    def __init__(self, models, views):
+        # Model`s path to the ModelEntry.
+        self.models = {}
+        # Model class to the ModelEntry.
+        self.senders = {}
+        for setting in models:
+            entry = ModelEntry(setting)
+            self.models[entry.path] = entry
+            self.senders[entry.model] = entry
+        # View function to the setting.
+        self.views = {}
+        for setting in views:
+            self.views[importpath(setting['view'], 'MODELURL_VIEWS')] = setting
+
+registry = None
+lock = threading.Lock()
+
+def get_registry():
+    """
+    Return registry for current settings.
+    It will be created on first call.
+    """
+    global registry
+    if registry is None:
+        lock.acquire()
+        try:
+            if registry is None:
+                registry = Registry(getattr(settings, 'MODELURL_MODELS', []),
+                    getattr(settings, 'MODELURL_VIEWS', []))
+        finally:
+            lock.release()
+    return registry
+
+def reload_registry():
+    """
+    Drop registry, so it will be created again for current settings.
+    Use it in tests that change settings.
+
+    >>> old = get_registry()
+    >>> reload_registry()
+    >>> get_registry() is old
+    False
+    """
+    global registry
+    lock.acquire()
+    try:
+        registry = None
+    finally:
+        lock.release()
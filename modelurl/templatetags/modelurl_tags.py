@@ -0,0 +1,14 @@
+from django import template
+
+from modelurl.utils import mark
+
+register = template.Library()
+
+@register.filter
+def macros(value):
+    """
+    Mark that response for current request contains macros.
+    Use it for content with macros if ``MODELURL_STRICT`` is enabled.
+    """
+    mark()
+    return value
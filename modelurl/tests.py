@@ -15,6 +15,131 @@ class Test(TestCase):
         import utils
         doctest.testmod(utils)
 
+    def test_importpath(self):
+        import importpath
+        doctest.testmod(importpath)
+
+    def test_matchers(self):
+        import matchers
+        doctest.testmod(matchers)
+
+    def test_registry(self):
+        import registry
+        doctest.testmod(registry)
+
+    def test_fields(self):
+        import fields
+        doctest.testmod(fields)
+
+    def test_mixins(self):
+        import mixins
+        doctest.testmod(mixins)
+
+    def test_links(self):
+        from example.models import Page, Item
+        from models import MacroLink
+        from utils import macro
+        page = Page.objects.get(pk=1)
+        item = Item.objects.get(pk=1)
+        page.content = '<a href="%s">Item</a><a href="%s">Page</a>' % (
+            macro(item), macro(Page.objects.get(pk=11)))
+        page.save()
+        self.assertEqual(MacroLink.objects.out_degree(page), 2)
+        self.assertEqual(MacroLink.objects.in_degree(item), 1)
+        page.content = '<a href="%s">Item</a>' % macro(item)
+        page.save()
+        self.assertEqual(MacroLink.objects.out_degree(page), 1)
+        self.assertEqual([link.source_pk for link in MacroLink.objects.incoming(item)], [u'1'])
+        page.delete()
+        self.assertEqual(MacroLink.objects.in_degree(item), 0)
+
+    def test_index(self):
+        from example.models import Item
+        from models import ModelUrlIndex
+        from utils import cache, bump_version, resolve
+        ModelUrlIndex.objects.create(key='example.models.Item 99',
+            model='example.models.Item', object_pk='99', url='/deleted')
+        ModelUrlIndex.objects.rebuild(chunk_size=1)
+        self.assertEqual(ModelUrlIndex.objects.get(
+            key='example.models.Item 2').url, '/item_by_barcode/second')
+        self.assertFalse(ModelUrlIndex.objects.filter(key='example.models.Item 99'))
+        item = Item.objects.get(pk=2)
+        item.barcode = 'changed'
+        item.save()
+        self.assertEqual(ModelUrlIndex.objects.get(
+            key='example.models.Item 2').url, '/item_by_barcode/changed')
+        cache.clear()
+        bump_version('example.models.Item')
+        bump_version('example.models.Page')
+        keys = [('example.models.Item', '2'), ('example.models.Page', '1')]
+        urls = {}
+        self.assertNumQueries(1, lambda: urls.update(resolve(keys)))
+        self.assertEqual(urls[('example.models.Item', '2')], '/item_by_barcode/changed')
+        self.assertEqual(urls[('example.models.Page', '1')], '/page_by_id/1')
+        item.delete()
+        self.assertFalse(ModelUrlIndex.objects.filter(key='example.models.Item 2'))
+
+    def test_bump(self):
+        from django.core.management import call_command
+        from utils import get_versions
+        version = get_versions(['example.models.Page'])['example.models.Page']
+        call_command('modelurl_bump', 'example.models.Page')
+        self.assertEqual(get_versions(['example.models.Page'])['example.models.Page'], version + 1)
+        # Versions of other processes can not be changed without shared cache.
+        from django.core.management.base import CommandError
+        from management.commands.modelurl_bump import Command
+        import utils
+        shared = utils.shared
+        utils.shared = None
+        try:
+            self.assertRaises(CommandError, Command().handle)
+        finally:
+            utils.shared = shared
+
+    def test_diskindex(self):
+        import diskindex
+        doctest.testmod(diskindex)
+
+    def test_replace_index(self):
+        import os, tempfile
+        from django.conf import settings
+        from django.core.management import call_command
+        from diskindex import MmapDict
+        from example.models import Item
+        from utils import get_replace_by_dict, reload_replace_by_dict
+        path = os.path.join(tempfile.mkdtemp(), 'index')
+        call_command('modelurl_replace_index', path)
+        settings.MODELURL_REPLACE_INDEX = path
+        reload_replace_by_dict()
+        try:
+            replace = get_replace_by_dict()
+            self.assertTrue(isinstance(replace.dct, MmapDict))
+            self.assertEqual(replace.text('/item_by_barcode/first'), '{@ example.models.Item 1 @}')
+            item = Item.objects.get(pk=1)
+            item.barcode = 'changed'
+            item.save()
+            self.assertEqual(replace.text('/item_by_barcode/first /item_by_barcode/changed'),
+                '/item_by_barcode/first {@ example.models.Item 1 @}')
+            # Urls from the file are not loaded to memory.
+            self.assertEqual(replace._urls, None)
+            self.assertEqual(replace.changed, {'{@ example.models.Item 1 @}': '/item_by_barcode/changed'})
+            item.delete()
+            self.assertEqual(replace.text('/item_by_barcode/changed'), '/item_by_barcode/changed')
+            # Only urls of changed model are loaded again after bulk changes.
+            Item.objects.filter(pk=2).update(barcode='updated')
+            self.assertTrue(get_replace_by_dict() is replace)
+            self.assertEqual(replace.text('/item_by_barcode/second /item_by_barcode/updated'),
+                '/item_by_barcode/second {@ example.models.Item 2 @}')
+            self.assertEqual(replace.text('/page_by_id/11'), '{@ example.models.Page 11 @}')
+            self.assertFalse([macro for macro in replace.changed if 'Page' in macro])
+            Item.objects.filter(pk=2).update(barcode='second')
+            self.assertEqual(get_replace_by_dict().text('/item_by_barcode/second'),
+                '{@ example.models.Item 2 @}')
+        finally:
+            del settings.MODELURL_REPLACE_INDEX
+            reload_replace_by_dict()
+            os.remove(path)
+
     def test_threads(self):
         pass
 
@@ -3,23 +3,38 @@ Utils to replace macro with url for specified objects.
 And to replace urls with macro.
 """
 
+import os
 import re
+import sys
+import time
 import threading
+from hashlib import md5
+from collections import OrderedDict
 
 from django.conf import settings
+from django.core.cache import get_cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models.signals import post_delete
 from django.core.urlresolvers import RegexURLResolver
 from django.template import NodeList
+from django.utils.encoding import force_unicode
+from django.utils.functional import wraps
 from django.utils.safestring import mark_safe
 
 from urlmethods import urlsplit, urljoin, local_response_unthreaded
 from urlmethods.threadmethod import threadmethod
 
-from importpath import importpath
+from diskindex import MmapDict, write
+from matchers import MmapMatcher, RegexMatcher, TrieMatcher
+from registry import get_registry
 
 local = threading.local()
 
 MACRO_RE = re.compile(r'{@\s*([.a-zA-Z]+)\s+(\S+)\s*@}')
 
+# Longest part of unclosed macro that will be kept between chunks.
+MACRO_MAX_LENGTH = 512
+
 CHECK_ELEMENTS = {
     'a': ['href', ],
     'area': ['href', ],
@@ -36,6 +51,426 @@ CHECK_ELEMENTS = {
     'q': ['cite', ],
 }
 
+class LruCache(object):
+    """
+    Thread safe dictionary with limited number of items.
+    Least recently used items will be removed first.
+    Cache is disabled if ``size`` is zero.
+
+    >>> cache = LruCache(2)
+    >>> cache.set('a', 1)
+    >>> cache.set('b', 2)
+    >>> cache.get('a')
+    1
+    >>> cache.set('c', 3)
+    >>> cache.get('b') is None
+    True
+    >>> cache.get('a'), cache.get('c')
+    (1, 3)
+    >>> cache.delete('a')
+    >>> cache.get('a') is None
+    True
+
+    >>> cache = LruCache(0)
+    >>> cache.set('a', 1)
+    >>> cache.get('a') is None
+    True
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        self.lock.acquire()
+        try:
+            try:
+                value = self.items.pop(key)
+            except KeyError:
+                return default
+            self.items[key] = value
+            return value
+        finally:
+            self.lock.release()
+
+    def set(self, key, value):
+        if not self.size:
+            return
+        self.lock.acquire()
+        try:
+            self.items.pop(key, None)
+            self.items[key] = value
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+        finally:
+            self.lock.release()
+
+    def delete(self, key):
+        self.lock.acquire()
+        try:
+            self.items.pop(key, None)
+        finally:
+            self.lock.release()
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            self.items.clear()
+        finally:
+            self.lock.release()
+
+# Versions and urls for ``(model, pk)`` pairs,
+# enabled by ``MODELURL_CACHE_SIZE`` setting.
+cache = LruCache(getattr(settings, 'MODELURL_CACHE_SIZE', 0))
+
+# Versions and expiration times for missed objects,
+# enabled by ``MODELURL_MISSING_TIMEOUT`` setting.
+missing = LruCache(getattr(settings, 'MODELURL_MISSING_CACHE_SIZE', 1000))
+
+# Number of macros that were replaced with empty url for each model.
+dead_macros = {}
+dead_macros_lock = threading.Lock()
+
+def get_dead_macros():
+    """
+    Return dictionary with number of macros
+    that were replaced with empty url for each model.
+    """
+    dead_macros_lock.acquire()
+    try:
+        return dict(dead_macros)
+    finally:
+        dead_macros_lock.release()
+
+def count_dead_macros(keys):
+    """
+    Count ``(model, pk)`` pairs that were replaced with empty url.
+    """
+    dead_macros_lock.acquire()
+    try:
+        for model, pk in keys:
+            dead_macros[model] = dead_macros.get(model, 0) + 1
+    finally:
+        dead_macros_lock.release()
+
+# Cache shared by all processes, enabled by ``MODELURL_CACHE`` setting.
+if getattr(settings, 'MODELURL_CACHE', None):
+    shared = get_cache(settings.MODELURL_CACHE)
+else:
+    shared = None
+
+def shared_key(path, version, value):
+    """
+    Return key in shared cache for url of object.
+    """
+    return 'modelurl:url:%s:%s:%s' % (path, version, value)
+
+def version_key(path):
+    """
+    Return key in shared cache for version of urls for model.
+    """
+    return 'modelurl:version:%s' % path
+
+def index_key(path, value):
+    """
+    Return key in ``ModelUrlIndex`` for object.
+    """
+    return u'%s %s' % (path, value)
+
+# Versions of urls for models if shared cache is not used.
+versions = {}
+versions_lock = threading.Lock()
+
+def get_versions(paths):
+    """
+    Return dictionary with current version of urls for each model in ``paths``.
+
+    # Version will be returned even if shared cache does not keep values
+    >>> import modelurl.utils
+    >>> from django.core.cache.backends.dummy import DummyCache
+    >>> modelurl.utils.shared = DummyCache('', {})
+    >>> get_versions(['example.models.Page'])['example.models.Page'] is not None
+    True
+    >>> modelurl.utils.shared = shared
+    """
+    if shared is None:
+        return dict([(path, versions.get(path, 0)) for path in paths])
+    names = dict([(version_key(path), path) for path in paths])
+    result = {}
+    for name, version in shared.get_many(names.keys()).iteritems():
+        result[names[name]] = version
+    for name, path in names.iteritems():
+        if path not in result:
+            # Version must not start from value that was used before eviction.
+            version = int(time.time() * 1000)
+            shared.add(name, version)
+            stored = shared.get(name)
+            if stored is None:
+                # Cache does not keep values, version will be new on each call.
+                stored = version
+            result[path] = stored
+    return result
+
+def bump_version(path):
+    """
+    Invalidate all cached urls for model.
+    Return new version.
+
+    >>> cache.clear()
+    >>> version = get_versions(['example.models.Page'])['example.models.Page']
+    >>> shared.set(shared_key('example.models.Page', version, 11), '/cached')
+    >>> resolve([('example.models.Page', '11')])[('example.models.Page', '11')]
+    '/cached'
+
+    >>> bump_version('example.models.Page') == version + 1
+    True
+    >>> get_versions(['example.models.Page'])['example.models.Page'] == version + 1
+    True
+    >>> resolve([('example.models.Page', '11')])[('example.models.Page', '11')]
+    '/page_by_id/11'
+    """
+    if shared is None:
+        versions_lock.acquire()
+        try:
+            versions[path] = versions.get(path, 0) + 1
+            return versions[path]
+        finally:
+            versions_lock.release()
+    name = version_key(path)
+    try:
+        return shared.incr(name)
+    except ValueError:
+        version = int(time.time() * 1000)
+        shared.set(name, version)
+        return version
+
+def bump(model, pks=None):
+    """
+    Invalidate all cached urls for ``model`` (class or path).
+    Use it after ``QuerySet.update``, raw SQL or data migrations.
+    Other processes will be affected only if versions are shared
+    with ``MODELURL_CACHE``, otherwise only current process is affected.
+    If ``MODELURL_INDEX`` is enabled urls of objects with pk in ``pks``
+    will be stored again, urls of all objects if ``pks`` is None.
+
+    >>> from example.models import Item
+    >>> from modelurl.models import ModelUrlIndex
+    >>> resolve([('example.models.Item', '1')])[('example.models.Item', '1')]
+    '/item_by_barcode/first'
+    >>> rows = ModelUrlIndex.objects.filter(model='example.models.Item').count()
+    >>> Item.objects.filter(pk=1).update(barcode='updated')
+    1
+    >>> resolve([('example.models.Item', '1')])[('example.models.Item', '1')]
+    '/item_by_barcode/updated'
+    >>> ModelUrlIndex.objects.filter(model='example.models.Item').count() == rows
+    True
+    >>> ModelUrlIndex.objects.get(key='example.models.Item 1').url
+    u'/item_by_barcode/updated'
+    >>> Item.objects.filter(pk=1).update(barcode='first')
+    1
+    """
+    if not isinstance(model, basestring):
+        model = '%s.%s' % (model.__module__, model.__name__)
+    if getattr(settings, 'MODELURL_INDEX', False):
+        entry = get_registry().models.get(model)
+        if entry is not None:
+            from modelurl.models import ModelUrlIndex
+            # Index must be updated before version is bumped.
+            if pks is None:
+                ModelUrlIndex.objects.rebuild([model])
+            else:
+                ModelUrlIndex.objects.update_urls(entry, pks)
+    bump_version(model)
+
+def get_etag(value):
+    """
+    Return ETag for content with macros.
+    It depends on ``value`` and versions of urls for models
+    referenced in ``value``, so no objects will be fetched.
+    Versions must be shared between processes with ``MODELURL_CACHE``,
+    otherwise process will not know about objects changed by other processes.
+
+    >>> etag = get_etag('<a href="{@ example.models.Page 1 @}">Page</a>')
+    >>> etag == get_etag('<a href="{@ example.models.Page 1 @}">Page</a>')
+    True
+    >>> version = bump_version('example.models.Page')
+    >>> etag == get_etag('<a href="{@ example.models.Page 1 @}">Page</a>')
+    False
+
+    >>> import modelurl.utils
+    >>> modelurl.utils.shared = None
+    >>> get_etag('<a href="{@ example.models.Page 1 @}">Page</a>')
+    Traceback (most recent call last):
+        ...
+    ImproperlyConfigured: MODELURL_ETAG requires MODELURL_CACHE setting
+    >>> modelurl.utils.shared = shared
+    """
+    if shared is None:
+        raise ImproperlyConfigured('MODELURL_ETAG requires MODELURL_CACHE setting')
+    models = get_registry().models
+    paths = set()
+    position = value.find('{@')
+    if position != -1:
+        for model, pk in MACRO_RE.findall(value, position):
+            if model in models:
+                paths.add(model)
+    digest = md5(value)
+    for path, version in sorted(get_versions(paths).iteritems()):
+        digest.update('\n%s %s' % (path, version))
+    return '"%s"' % digest.hexdigest()
+
+class SnapshotOverflow(Exception):
+    """
+    Snapshot is larger than allowed.
+    """
+
+class Snapshot(object):
+    """
+    Urls for all objects of registered model.
+    ``size`` is approximate number of bytes used by urls.
+    """
+
+    def __init__(self, entry, version, limit):
+        self.entry = entry
+        self.version = version
+        self.limit = limit
+        self.urls = {}
+        self.size = sys.getsizeof(self.urls)
+        to_python = entry.model._meta.pk.to_python
+        for value, url in entry.iter_urls():
+            # Bulk function can return pks in another form.
+            try:
+                value = to_python(value)
+            except Exception:
+                continue
+            self.set(value, url)
+
+    def set(self, value, url):
+        url = url.encode('utf-8')
+        self.delete(value)
+        self.urls[value] = url
+        self.size += sys.getsizeof(value) + sys.getsizeof(url)
+        if self.size > self.limit:
+            raise SnapshotOverflow
+
+    def delete(self, value):
+        try:
+            url = self.urls.pop(value)
+        except KeyError:
+            return
+        self.size -= sys.getsizeof(value) + sys.getsizeof(url)
+
+# Model`s path to the Snapshot, or to None if snapshot is too large.
+snapshots = {}
+snapshots_lock = threading.Lock()
+
+def get_snapshot(entry, version):
+    """
+    Return Snapshot for registered model or None if it is not available.
+    Snapshot will be loaded on first call and when ``version`` will be changed.
+
+    >>> from example.models import Item
+    >>> entry = get_registry().models['example.models.Item']
+    >>> entry.setting['snapshot'] = True
+    >>> version = get_versions([entry.path])[entry.path]
+    >>> snapshot = get_snapshot(entry, version)
+    >>> snapshot.urls
+    {1: '/item_by_barcode/first', 2: '/item_by_barcode/second'}
+    >>> snapshot.size > 0
+    True
+
+    # Snapshot will be updated when objects will be changed
+    >>> item = Item.objects.create(barcode='third')
+    >>> resolve([(entry.path, str(item.pk))])[(entry.path, str(item.pk))]
+    '/item_by_barcode/third'
+    >>> get_snapshot(entry, get_versions([entry.path])[entry.path]) is snapshot
+    True
+    >>> item.delete()
+    >>> sorted(snapshot.urls.keys())
+    [1, 2]
+
+    # Pks returned by bulk function will be normalized
+    >>> bulk_function = entry.bulk_function
+    >>> entry.bulk_function = lambda pks: dict([(str(pk), '/%s' % pk) for pk in pks])
+    >>> reload_snapshots()
+    >>> get_snapshot(entry, version).urls
+    {1: '/1', 2: '/2'}
+    >>> entry.bulk_function = bulk_function
+    >>> reload_snapshots()
+
+    # Large snapshot will not be used
+    >>> entry.setting['snapshot_limit'] = 10
+    >>> reload_snapshots()
+    >>> get_snapshot(entry, version) is None
+    True
+    >>> del entry.setting['snapshot'], entry.setting['snapshot_limit']
+    >>> reload_snapshots()
+    """
+    if not entry.setting.get('snapshot', False):
+        return None
+    try:
+        snapshot = snapshots[entry.path]
+    except KeyError:
+        snapshot = False
+    if snapshot is None:
+        return None
+    if snapshot and snapshot.version == version:
+        return snapshot
+    snapshots_lock.acquire()
+    try:
+        limit = entry.setting.get('snapshot_limit',
+            getattr(settings, 'MODELURL_SNAPSHOT_LIMIT', 10 * 1024 * 1024))
+        try:
+            snapshot = Snapshot(entry, version, limit)
+        except SnapshotOverflow:
+            snapshot = None
+        snapshots[entry.path] = snapshot
+        return snapshot
+    finally:
+        snapshots_lock.release()
+
+def reload_snapshots():
+    """
+    Drop all snapshots, so they will be loaded again.
+    """
+    snapshots_lock.acquire()
+    try:
+        snapshots.clear()
+    finally:
+        snapshots_lock.release()
+
+def invalidate(sender, instance, **kwargs):
+    """
+    Signal handler to remove url for changed or deleted object from cache.
+    """
+    try:
+        entry = get_registry().senders[sender]
+    except KeyError:
+        return
+    cache.delete((entry.path, instance.pk))
+    missing.delete((entry.path, instance.pk))
+    version = bump_version(entry.path)
+    snapshot = snapshots.get(entry.path)
+    if not snapshot:
+        return
+    snapshots_lock.acquire()
+    try:
+        if snapshot.version is not None and version == snapshot.version + 1:
+            # Nobody else has changed objects since snapshot was loaded.
+            try:
+                if kwargs.get('signal') is post_delete:
+                    snapshot.delete(instance.pk)
+                else:
+                    snapshot.set(instance.pk, entry.url(instance))
+                snapshot.version = version
+                return
+            except SnapshotOverflow:
+                pass
+        del snapshots[entry.path]
+    finally:
+        snapshots_lock.release()
+
 def MACRO_REPL(match):
     """
     Replace function for macro.
@@ -65,22 +500,291 @@ def MACRO_REPL(match):
     ... u'<a href="/page_by_id/1">\u00a0</a>')
     True
     """
-    model, pk = match.groups()
-    for setting in getattr(settings, 'MODELURL_MODELS', []):
-        if model == setting.get('model', ''):
-            function = setting.get('function', 'get_absolute_url')
-            break
-    else:
-        return mark_safe('')
-    model = importpath(model)
+    key = match.groups()
+    return mark_safe(resolve([key])[key])
+
+def resolve(keys):
+    """
+    Return dictionary with url for each ``(model, pk)`` pair in ``keys``.
+    Objects of each model will be fetched with single query.
+    Url will be empty string for missed objects and unregistered models.
+
+    >>> urls = resolve([('example.models.Page', '1'), ('example.models.Item', '2'),
+    ...     ('example.models.Page', '12'), ('example.models.DoesNotExists', '1')])
+    >>> urls[('example.models.Page', '1')]
+    '/page_by_id/1'
+    >>> urls[('example.models.Item', '2')]
+    '/item_by_barcode/second'
+    >>> urls[('example.models.Page', '12')]
+    ''
+    >>> urls[('example.models.DoesNotExists', '1')]
+    ''
+
+    # Number of macros with empty url will be counted
+    >>> dead = get_dead_macros().get('example.models.DoesNotExists', 0)
+    >>> urls = resolve([('example.models.DoesNotExists', '1')])
+    >>> get_dead_macros()['example.models.DoesNotExists'] - dead
+    1
+
+    # Each occurrence of macro will be counted
+    >>> dead = get_dead_macros().get('example.models.Page', 0)
+    >>> urls = resolve([('example.models.Page', '12'), ('example.models.Page', '12')])
+    >>> get_dead_macros()['example.models.Page'] - dead
+    2
+
+    # Pks returned by bulk function will be normalized
+    >>> entry = get_registry().models['example.models.Item']
+    >>> bulk_function = entry.bulk_function
+    >>> entry.bulk_function = lambda pks: {'5': '/five', '99': '/extra'}
+    >>> resolve([('example.models.Item', '5')])[('example.models.Item', '5')]
+    '/five'
+    >>> entry.bulk_function = bulk_function
+    >>> cache.delete(('example.models.Item', 5))
+
+    # Missed objects will be cached
+    >>> settings.MODELURL_MISSING_TIMEOUT = 60
+    >>> from example.models import Page
+    >>> urls = resolve([('example.models.Page', '12')])
+    >>> missing.get(('example.models.Page', 12)) is not None
+    True
+    >>> page = Page.objects.create(pk=12, content='')
+    >>> resolve([('example.models.Page', '12')])[('example.models.Page', '12')]
+    '/page_by_id/12'
+    >>> del settings.MODELURL_MISSING_TIMEOUT
+    """
+    result = {}
+    groups = {}
+    for key in keys:
+        result[key] = ''
+        groups.setdefault(key[0], set()).add(key[1])
+    models = get_registry().models
+    missed = {}
+    for path, pks in groups.iteritems():
+        try:
+            entry = models[path]
+        except KeyError:
+            continue
+        for pk in pks:
+            try:
+                value = entry.model._meta.pk.to_python(pk)
+            except Exception:
+                continue
+            missed.setdefault((path, value), []).append(pk)
+    if not missed:
+        count_dead_macros(keys)
+        return result
+    versions = get_versions(set([path for path, value in missed]))
+    found = {}
+    timeout = getattr(settings, 'MODELURL_MISSING_TIMEOUT', 0)
+    now = time.time()
+
+    def store(key, url, share=True):
+        cache.set(key, (versions[key[0]], url))
+        if share and shared is not None:
+            found[shared_key(key[0], versions[key[0]], key[1])] = url
+        for pk in missed.pop(key, ()):
+            result[(key[0], pk)] = url
+
+    snapshot_paths = {}
+    for path in versions:
+        snapshot = get_snapshot(models[path], versions[path])
+        if snapshot is not None:
+            snapshot_paths[path] = snapshot.urls
+    for key in missed.keys():
+        if key[0] in snapshot_paths:
+            url = snapshot_paths[key[0]].get(key[1], '')
+            for pk in missed.pop(key):
+                result[(key[0], pk)] = url
+            continue
+        cached = cache.get(key)
+        if cached is not None and cached[0] == versions[key[0]]:
+            for pk in missed.pop(key):
+                result[(key[0], pk)] = cached[1]
+        elif timeout:
+            cached = missing.get(key)
+            if cached is not None and cached[0] == versions[key[0]] and cached[1] > now:
+                del missed[key]
+    if missed and shared is not None:
+        names = {}
+        for key in missed:
+            names[shared_key(key[0], versions[key[0]], key[1])] = key
+        for name, url in shared.get_many(names.keys()).iteritems():
+            store(names[name], url, False)
+    if missed and getattr(settings, 'MODELURL_INDEX', False):
+        from modelurl.models import ModelUrlIndex
+        names = {}
+        for key in missed:
+            names[index_key(*key)] = key
+        for name, url in ModelUrlIndex.objects.filter(
+            key__in=names.keys()).values_list('key', 'url'):
+            store(names[name], url.encode('utf-8'))
+    fetch = {}
+    for path, value in missed:
+        fetch.setdefault(path, []).append(value)
+    for path, values in fetch.iteritems():
+        entry = models[path]
+        for value, url in entry.urls(values).iteritems():
+            # Bulk function can return pks in another form or not requested pks.
+            try:
+                value = entry.model._meta.pk.to_python(value)
+            except Exception:
+                continue
+            if (path, value) in missed:
+                store((path, value), url.encode('utf-8'))
+    if found:
+        shared.set_many(found)
+    if timeout:
+        for key in missed:
+            missing.set(key, (versions[key[0]], now + timeout))
+    count_dead_macros([key for key in keys if not result[key]])
+    return result
+
+def expand(value):
+    """
+    Replace all macros in ``value`` with urls.
+    Result is the same as for ``MACRO_RE.sub(MACRO_REPL, value)``,
+    but all objects will be fetched with one query per model.
+
+    >>> expand('<a href="{@ example.models.Page 1 @}">Page</a><a href="{@ example.models.Page 11 @}">Page</a>')
+    '<a href="/page_by_id/1">Page</a><a href="/page_by_id/11">Page</a>'
+
+    >>> expand('<a href="{@ example.models.Item 2 @}">Item</a><a href="{@ example.models.Page 12 @}">Page</a>')
+    '<a href="/item_by_barcode/second">Item</a><a href="">Page</a>'
+
+    >>> expand('<a href="{@ example.models.DoesNotExists 1 @}">Page</a><a href="{@ 1 @}">Page</a>')
+    '<a href="">Page</a><a href="{@ 1 @}">Page</a>'
+
+    # Value without macros will be returned as is
+    >>> value = '<a href="/page_by_id/1">Page</a>'
+    >>> expand(value) is value
+    True
+    """
+    start = value.find('{@')
+    if start == -1:
+        return value
+    spans = [(match.start(), match.end(), match.groups())
+        for match in MACRO_RE.finditer(value, start)]
+    if not spans:
+        return value
+    return splice(value, spans)
+
+def splice(value, spans):
+    """
+    Replace ``(start, end, (model, pk))`` spans in ``value`` with urls.
+    """
+    urls = resolve([key for start, end, key in spans])
+    result = []
+    position = 0
+    for start, end, key in spans:
+        result.append(value[position:start])
+        result.append(urls[key])
+        position = end
+    result.append(value[position:])
+    return ''.join(result)
+
+def tokenize(value):
+    """
+    Return string with positions of macros in ``value``.
+    First line is length of value, other lines are ``start end model pk``.
+
+    >>> tokenize(u'<a href="{@ example.models.Page 1 @}">\u00a0</a>')
+    u'43\\n9 36 example.models.Page 1'
+    >>> tokenize(None)
+    u''
+    """
+    if value is None:
+        return u''
+    value = force_unicode(value)
+    lines = [unicode(len(value))]
+    for match in MACRO_RE.finditer(value):
+        lines.append(u'%s %s %s %s' % ((match.start(), match.end()) + match.groups()))
+    return u'\n'.join(lines)
+
+def expand_tokens(value, tokens):
+    """
+    Replace macros in ``value`` using positions from ``tokens``
+    that was returned by ``tokenize``.
+    If ``tokens`` does not correspond to ``value`` ``expand`` will be used.
+
+    >>> value = u'<a href="{@ example.models.Page 1 @}">\u00a0</a>'
+    >>> expand_tokens(value, tokenize(value)) == u'<a href="/page_by_id/1">\u00a0</a>'
+    True
+    >>> expand_tokens(value, '') == u'<a href="/page_by_id/1">\u00a0</a>'
+    True
+
+    # Changed macro of the same length will not be taken from ``tokens``
+    >>> changed = value.replace('Page 1', 'Page 2')
+    >>> expand_tokens(changed, tokenize(value)) == u'<a href="">\u00a0</a>'
+    True
+    """
+    lines = tokens.split('\n')
     try:
-        obj = model.objects.get(pk=pk)
-    except model.DoesNotExist:
-        return mark_safe('')
-    if not function:
-        function = 'get_absolute_url'
-    url = getattr(obj, function)()
-    return mark_safe(url.encode('utf-8'))
+        if int(lines[0]) != len(value):
+            raise ValueError
+        spans = []
+        for line in lines[1:]:
+            start, end, model, pk = line.split(' ', 3)
+            start, end = int(start), int(end)
+            match = MACRO_RE.match(value, start)
+            if match is None or match.end() != end or match.groups() != (model, pk):
+                raise ValueError
+            spans.append((start, end, (model, pk)))
+    except ValueError:
+        return expand(value)
+    if not spans:
+        return value
+    return splice(value, spans)
+
+def expand_chunks(chunks):
+    """
+    Replace all macros in iterable ``chunks``, yield results chunk by chunk.
+    Unclosed macro at the end of the chunk will be joined with the next one.
+
+    >>> list(expand_chunks(['<a href="{@ example.mod', 'els.Page 1 @}">',
+    ...     'Page</a>{', '@ example.models.Page 11 @}', '{@ link']))
+    ['<a href="', '/page_by_id/1">', 'Page</a>', '/page_by_id/11', '{@ link']
+    """
+    tail = ''
+    for chunk in chunks:
+        value = tail + chunk
+        split = value.rfind('{@')
+        if split == -1 or value.find('@}', split) != -1 or \
+            len(value) - split > MACRO_MAX_LENGTH:
+            split = len(value)
+            if value.endswith('{'):
+                split -= 1
+        tail = value[split:]
+        if split:
+            yield expand(value[:split])
+    if tail:
+        yield expand(tail)
+
+def mark(response=None):
+    """
+    Mark that ``response`` contains macros.
+    If ``response`` is None response for current request will be marked.
+    Only marked responses are processed if ``MODELURL_STRICT`` is enabled.
+    """
+    if response is None:
+        local.modelurl_macros = True
+    else:
+        response.modelurl_macros = True
+    return response
+
+def marked(response):
+    """
+    Return whether ``response`` or current request was marked.
+    """
+    return getattr(response, 'modelurl_macros', False) or \
+        getattr(local, 'modelurl_macros', False)
+
+def mark_view(view):
+    """
+    Decorator for views that return content with macros.
+    """
+    def wrapper(request, *args, **kwargs):
+        return mark(view(request, *args, **kwargs))
+    return wraps(view)(wrapper)
 
 def macro(obj):
     """
@@ -166,19 +870,35 @@ class ReplaceByDict(object):
 
     >>> replace.text('<a href="/page_by_id/12">page</a> and /item_by_barcode/second')
     '<a href="/page_by_id/12">page</a> and {@ example.models.Item 2 @}'
+
+    >>> replace.add('/new', '{@ example.models.Page 12 @}')
+    >>> replace.remove('/page_by_id/11')
+    >>> replace.text('/new and /page_by_id/11')
+    '{@ example.models.Page 12 @} and /page_by_id/11'
+    >>> replace.update({'/page_by_id/11': '{@ example.models.Page 11 @}'})
+    >>> replace.text('/new and /page_by_id/11')
+    '{@ example.models.Page 12 @} and {@ example.models.Page 11 @}'
+
+    >>> replace = ReplaceByDict(dictionary, matcher=RegexMatcher)
+    >>> replace.text('<a href="http://another.com/page_by_id/1">page</a> and /page_by_id/11')
+    '<a href="http://another.com{@ example.models.Page 1 @}">page</a> and {@ example.models.Page 11 @}'
     """
 
-    def __init__(self, dict, *args, **kwargs):
+    def __init__(self, dict, matcher=TrieMatcher, *args, **kwargs):
         """
         Set ``dict`` dictionary for replace operations.
         Keys must be an url.
         Value must be macro (use ``modelurl.generate_macro`` function to get it).
+        ``matcher`` is class to find urls in text
+        (``modelurl.matchers.TrieMatcher`` or ``modelurl.matchers.RegexMatcher``).
         """
         super(ReplaceByDict, self).__init__(*args, **kwargs)
         self.source = dict
+        self.matcher_class = matcher
         self._dct = None
         self._lst = None
         self._regexp = None
+        self._matcher = None
 
     @property
     def dct(self):
@@ -204,12 +924,120 @@ class ReplaceByDict(object):
         Return regexp for all urls.
         """
         if self._regexp is None:
-            self._regexp = re.compile(r'''(%s)(?=\s|[#?"'>]|$)''' %
-                '|'.join(['(%s)' % re.escape(key)
-                    for key, value in self.lst]),
-                re.IGNORECASE)
+            self._regexp = RegexMatcher(self.dct).regexp
         return self._regexp
 
+    @property
+    def matcher(self):
+        """
+        Return matcher for all urls.
+        """
+        if self._matcher is None:
+            self._matcher = self.matcher_class(self.dct)
+        return self._matcher
+
+    @classmethod
+    def from_models(cls, paths=None, chunk_size=1000, build_matcher=True, *args, **kwargs):
+        """
+        Return instance with urls for all objects of registered models.
+        ``paths`` is list of models to be used, all models by default.
+        Objects will be fetched by chunks of ``chunk_size`` items.
+        Matcher will be built too if ``build_matcher`` is True.
+        Number of urls, approximate memory usage in bytes and time of building
+        in seconds for dictionary and for matcher will be stored in ``stats`` attribute.
+
+        >>> replace = ReplaceByDict.from_models(['example.models.Page'], chunk_size=1)
+        >>> replace.text('/page_by_id/11 /item_by_barcode/first')
+        '{@ example.models.Page 11 @} /item_by_barcode/first'
+        >>> replace.stats['urls']
+        2
+        >>> replace.stats['memory'] > 0, replace.stats['matcher_memory'] > 0
+        (True, True)
+        """
+        start = time.time()
+        models = get_registry().models
+        dictionary = {}
+        for path in paths or models.keys():
+            for value, url in models[path].iter_urls(chunk_size):
+                dictionary[url.lower()] = '{@ %s %s @}' % (path, value)
+        replace = cls(dictionary, *args, **kwargs)
+        # Keys are already lower-cased.
+        replace._dct = dictionary
+        built = time.time()
+        replace.stats = {
+            'urls': len(dictionary),
+            'memory': sys.getsizeof(dictionary) + sum([sys.getsizeof(key) +
+                sys.getsizeof(value) for key, value in dictionary.iteritems()]),
+            'time': built - start,
+        }
+        if build_matcher:
+            size = getattr(replace.matcher, 'size', None)
+            replace.stats['matcher_memory'] = size and size() or 0
+            replace.stats['matcher_time'] = time.time() - built
+        return replace
+
+    @classmethod
+    def open(cls, path, matcher=MmapMatcher, *args, **kwargs):
+        """
+        Return instance with urls from file saved by ``save``.
+        File is mapped to memory, so it will be shared between processes.
+        Changes are not written to the file.
+
+        >>> import os, tempfile
+        >>> path = os.path.join(tempfile.mkdtemp(), 'index')
+        >>> ReplaceByDict({'/Page_by_id/1': '{@ example.models.Page 1 @}'}).save(path)
+        >>> replace = ReplaceByDict.open(path)
+        >>> replace.text('<a href="/page_by_id/1">')
+        '<a href="{@ example.models.Page 1 @}">'
+        >>> replace.url('/PAGE_BY_ID/1')
+        '{@ example.models.Page 1 @}'
+        >>> replace.add('/page_by_id/2', '{@ example.models.Page 2 @}')
+        >>> replace.remove('/page_by_id/1')
+        >>> replace.text('/page_by_id/1 /page_by_id/2')
+        '/page_by_id/1 {@ example.models.Page 2 @}'
+        >>> replace.dct.close()
+        >>> os.remove(path)
+        """
+        dictionary = MmapDict(path)
+        replace = cls(dictionary, matcher, *args, **kwargs)
+        replace._dct = dictionary
+        return replace
+
+    def save(self, path):
+        """
+        Save urls and macros to the file to be opened with ``open``.
+        """
+        write(self.dct, path)
+
+    def add(self, url, macro):
+        """
+        Add ``url`` to be replaced with ``macro``.
+        """
+        key = url.lower()
+        self.dct[key] = macro
+        self._lst = None
+        self._regexp = None
+        if self._matcher is not None:
+            self._matcher.add(key, macro)
+
+    def remove(self, url):
+        """
+        Remove ``url`` from dictionary.
+        """
+        key = url.lower()
+        self.dct.pop(key, None)
+        self._lst = None
+        self._regexp = None
+        if self._matcher is not None:
+            self._matcher.remove(key)
+
+    def update(self, mapping):
+        """
+        Add urls and macros from ``mapping`` dictionary.
+        """
+        for url, macro in mapping.iteritems():
+            self.add(url, macro)
+
     def url(self, value):
         """
         Return macro for specified ``value``.
@@ -224,15 +1052,217 @@ class ReplaceByDict(object):
         """
         Replace urls in ``text`` with macros.
         """
-        def replace(match):
-            length = len(self.lst)
-            for index, value in enumerate(match.groups()):
-                if index == 0 or index > length:
-                    continue
-                if value is not None:
-                    return self.lst[index - 1][1]
-            return ''
-        return self.regexp.sub(replace, value)
+        return self.matcher.sub(value)
+
+class ModelReplaceByDict(ReplaceByDict):
+    """
+    Replace urls with macros for all objects of registered models.
+    Use ``get_replace_by_dict`` to get instance for current process
+    that will be updated when objects will be saved or deleted.
+
+    >>> from example.models import Item
+    >>> replace = get_replace_by_dict()
+    >>> replace.text('/page_by_id/11 /item_by_barcode/first')
+    '{@ example.models.Page 11 @} {@ example.models.Item 1 @}'
+
+    >>> item = Item.objects.create(barcode='third')
+    >>> replace.text('/item_by_barcode/third') == macro(item)
+    True
+    >>> item.barcode = 'changed'
+    >>> item.save()
+    >>> replace.text('/item_by_barcode/third /item_by_barcode/changed') == (
+    ...     '/item_by_barcode/third %s' % macro(item))
+    True
+    >>> item.delete()
+    >>> replace.text('/item_by_barcode/changed')
+    '/item_by_barcode/changed'
+    >>> get_replace_by_dict() is replace
+    True
+
+    # Urls of model will be loaded again after bulk operations
+    >>> Item.objects.filter(pk=2).update(barcode='updated')
+    1
+    >>> get_replace_by_dict() is replace
+    True
+    >>> replace.text('/item_by_barcode/second /item_by_barcode/updated')
+    '/item_by_barcode/second {@ example.models.Item 2 @}'
+    >>> Item.objects.filter(pk=2).update(barcode='second')
+    1
+    >>> reload_replace_by_dict()
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.lock = threading.Lock()
+        # Macro to the lower-cased url (None for deleted object)
+        # for objects changed in this process.
+        self.changed = {}
+        self._urls = None
+        # Versions of urls for models and modification time of opened file.
+        self.versions = {}
+        self.mtime = None
+        super(ModelReplaceByDict, self).__init__(*args, **kwargs)
+
+    def find_url(self, macro):
+        """
+        Return lower-cased url for ``macro`` or None.
+        Urls in file opened with ``open`` will be found by binary search,
+        dictionary with url for each macro will be built for other instances.
+        """
+        if macro in self.changed:
+            return self.changed[macro]
+        find_key = getattr(self.dct, 'find_key', None)
+        if find_key is not None:
+            return find_key(macro)
+        if self._urls is None:
+            self._urls = dict([(macro, url) for url, macro in self.dct.iteritems()])
+        return self._urls.get(macro)
+
+    def update_object(self, entry, obj, deleted=False):
+        """
+        Update url for ``obj`` of registered model.
+        """
+        macro = '{@ %s %s @}' % (entry.path, obj.pk)
+        if deleted:
+            url = None
+        else:
+            url = entry.url(obj)
+        self.lock.acquire()
+        try:
+            old = self.find_url(macro)
+            if old is not None and self.dct.get(old) == macro:
+                self.remove(old)
+            if url is None:
+                self.changed[macro] = None
+            else:
+                self.changed[macro] = url.lower()
+                self.add(url, macro)
+        finally:
+            self.lock.release()
+
+    def model_urls(self, path):
+        """
+        Return list of urls and macros for objects of model with ``path``.
+        """
+        prefix = '{@ %s ' % path
+        find_values = getattr(self.dct, 'find_values', None)
+        if find_values is None:
+            return [(url, macro) for url, macro in self.dct.iteritems()
+                if macro.startswith(prefix)]
+        macros = set(find_values(prefix))
+        macros.update([macro for macro in self.changed if macro.startswith(prefix)])
+        result = []
+        for macro in macros:
+            url = self.find_url(macro)
+            if url is not None and self.dct.get(url) == macro:
+                result.append((url, macro))
+        return result
+
+    def reload_model(self, entry, chunk_size=1000):
+        """
+        Replace urls for all objects of registered model with current ones.
+        Urls of other models will not be changed.
+        """
+        urls = [(url, '{@ %s %s @}' % (entry.path, value))
+            for value, url in entry.iter_urls(chunk_size)]
+        self.lock.acquire()
+        try:
+            for url, macro in self.model_urls(entry.path):
+                self.remove(url)
+                self.changed[macro] = None
+            for url, macro in urls:
+                self.add(url, macro)
+                self.changed[macro] = url.lower()
+        finally:
+            self.lock.release()
+
+replace_by_dict = None
+replace_by_dict_lock = threading.Lock()
+
+def get_replace_index_mtime():
+    """
+    Return modification time of ``MODELURL_REPLACE_INDEX`` file or None.
+    """
+    path = getattr(settings, 'MODELURL_REPLACE_INDEX', None)
+    if path and os.path.exists(path):
+        return os.path.getmtime(path)
+    return None
+
+def load_replace_by_dict():
+    """
+    Return new ModelReplaceByDict with current versions of urls.
+    It will be opened from ``MODELURL_REPLACE_INDEX`` file if it exists.
+    """
+    # Versions must be taken before urls.
+    versions = get_versions(get_registry().models.keys())
+    mtime = get_replace_index_mtime()
+    if mtime is not None:
+        replace = ModelReplaceByDict.open(settings.MODELURL_REPLACE_INDEX)
+    else:
+        replace = ModelReplaceByDict.from_models()
+    replace.mtime = mtime
+    replace.versions = versions
+    return replace
+
+def get_replace_by_dict():
+    """
+    Return ModelReplaceByDict for current process.
+    It will be created on first call or opened from
+    ``MODELURL_REPLACE_INDEX`` file if it exists.
+    Urls of model will be loaded again when they will be changed
+    by another process or by bulk operation.
+    Instance will be opened again when file will be changed.
+    """
+    global replace_by_dict
+    replace = replace_by_dict
+    versions = None
+    if replace is not None:
+        versions = get_versions(replace.versions.keys())
+        if replace.versions == versions:
+            return replace
+    replace_by_dict_lock.acquire()
+    try:
+        if replace_by_dict is None or (replace_by_dict is replace and
+            replace.mtime != get_replace_index_mtime()):
+            replace_by_dict = load_replace_by_dict()
+        elif replace_by_dict is replace:
+            models = get_registry().models
+            for path, version in versions.iteritems():
+                if replace.versions.get(path) != version:
+                    replace.reload_model(models[path])
+                    replace.versions[path] = version
+        return replace_by_dict
+    finally:
+        replace_by_dict_lock.release()
+
+def reload_replace_by_dict():
+    """
+    Drop ModelReplaceByDict for current process, so it will be created again.
+    """
+    global replace_by_dict
+    replace_by_dict = None
+
+def sync_replace_by_dict(sender, instance, **kwargs):
+    """
+    Signal handler to update ModelReplaceByDict
+    when object of registered model will be saved or deleted.
+    """
+    replace = replace_by_dict
+    if replace is None:
+        return
+    try:
+        entry = get_registry().senders[sender]
+    except KeyError:
+        return
+    version = get_versions([entry.path])[entry.path]
+    if version is None or replace.versions.get(entry.path) is None:
+        # Versions are not known, instance will be created again.
+        reload_replace_by_dict()
+        return
+    if replace.versions[entry.path] != version - 1:
+        # Urls were changed by somebody else, model will be loaded again.
+        return
+    replace.update_object(entry, instance, kwargs.get('signal') is post_delete)
+    replace.versions[entry.path] = version
 
 def render(func):
     """
@@ -466,9 +1496,7 @@ class ReplaceByView(object):
         function will return ''
         """
         super(ReplaceByView, self).__init__(*args, **kwargs)
-        self.views = {}
-        for setting in getattr(settings, 'MODELURL_VIEWS', []):
-            self.views[importpath(setting['view'])] = setting
+        self.views = get_registry().views
         self.check_sites = [value.lower() for value in check_sites]
         self.check_schemes = [value.lower() for value in check_schemes]
         self.check_unregistered = check_unregistered